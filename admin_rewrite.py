@@ -1,14 +1,25 @@
 import os
+import sys
 import json
+import asyncio
+import string
+import keyword
+import shutil
 import argparse
 import subprocess
 from pathlib import Path
+from functools import cache, lru_cache
 from datetime import date, datetime
 
 try:
-    from openai import OpenAI
+    import pygit2
 except Exception:
-    OpenAI = None
+    pygit2 = None
+
+try:
+    import orjson
+except Exception:
+    orjson = None
 
 # ---------------------------
 # Helpers
@@ -17,11 +28,20 @@ except Exception:
 def load_json(path: Path) -> dict:
     if not path.exists():
         raise SystemExit(f"Missing required file: {path}")
+    if orjson:
+        return orjson.loads(path.read_bytes())
     return json.loads(path.read_text(encoding="utf-8"))
 
+def dump_json(obj) -> bytes:
+    """Pretty-printed UTF-8 JSON (indent=2), via orjson when available."""
+    if orjson:
+        return orjson.dumps(obj, option=orjson.OPT_INDENT_2)
+    return json.dumps(obj, ensure_ascii=False, indent=2).encode("utf-8")
+
 def parse_yyyy_mm_dd(s: str) -> date:
     return datetime.strptime(s, "%Y-%m-%d").date()
 
+@lru_cache(maxsize=512)
 def clamp_x(text: str, max_chars: int) -> str:
     """Best-effort clamp to max chars; prefer templates that already fit."""
     t = " ".join(text.split())
@@ -29,11 +49,14 @@ def clamp_x(text: str, max_chars: int) -> str:
         return t
     return t[: max_chars - 1].rstrip() + "…"
 
+@lru_cache(maxsize=256)
 def format_int(n: int) -> str:
     return f"{n:,}"
 
-def compute_vars(cfg: dict) -> dict:
-    today = date.today()
+@lru_cache(maxsize=8)
+def _compute_vars_cached(cfg_json: str, today_iso: str) -> tuple:
+    cfg = json.loads(cfg_json)
+    today = date.fromisoformat(today_iso)
     start = parse_yyyy_mm_dd(cfg["start_date"])
     days = (today - start).days
     if days < 0:
@@ -41,28 +64,41 @@ def compute_vars(cfg: dict) -> dict:
 
     killed = int(cfg.get("killed_estimate", 0))
 
-    return {
-        "country": cfg.get("country", "Iran"),
-        "start_date": start.strftime("%Y-%m-%d"),
-        "today": today.strftime("%Y-%m-%d"),
-        "days": days,
-        "days_phrase": f"{days} days" if days != 1 else "1 day",
-        "killed_estimate": killed,
-        "killed_estimate_fmt": format_int(killed),
-        "injured_phrase": cfg.get("injured_phrase", "countless injured"),
-        "regime_terms": cfg.get("regime_terms", "the Islamic regime and the IRGC"),
-    }
+    return (
+        ("country", cfg.get("country", "Iran")),
+        ("start_date", start.strftime("%Y-%m-%d")),
+        ("today", today.strftime("%Y-%m-%d")),
+        ("days", days),
+        ("days_phrase", f"{days} days" if days != 1 else "1 day"),
+        ("killed_estimate", killed),
+        ("killed_estimate_fmt", format_int(killed)),
+        ("injured_phrase", cfg.get("injured_phrase", "countless injured")),
+        ("regime_terms", cfg.get("regime_terms", "the Islamic regime and the IRGC")),
+    )
 
-def fill(template: str, vars_: dict) -> str:
-    return template.format(**vars_)
+def compute_vars(cfg: dict) -> dict:
+    """Template variables for today; cached per (config, day)."""
+    return dict(_compute_vars_cached(json.dumps(cfg, sort_keys=True), date.today().isoformat()))
 
+@cache
 def get_client():
     api_key = os.environ.get("OPENAI_API_KEY")
     if not api_key:
         return None
-    if not OpenAI:
+    # Imported lazily: openai pulls in its HTTP stack and pydantic, which is
+    # wasted startup time on runs without --ai.
+    try:
+        from openai import OpenAI, DefaultHttpxClient
+    except Exception:
         return None
-    return OpenAI(api_key=api_key)
+
+    # One pooled connection shared by every request; HTTP/2 multiplexes
+    # concurrent paraphrase calls over it (needs the `h2` extra: httpx[http2]).
+    try:
+        http_client = DefaultHttpxClient(http2=True, timeout=60.0)
+    except ImportError:
+        http_client = DefaultHttpxClient(timeout=60.0)
+    return OpenAI(api_key=api_key, http_client=http_client)
 
 SYSTEM_PROMPT = """
 Rewrite sensitive informational messages.
@@ -77,84 +113,279 @@ Rules:
 Return exactly N lines, each a standalone variant.
 """.strip()
 
+# Routes every request to the same server-side prompt cache; SYSTEM_PROMPT is
+# sent first and must stay byte-stable for the cached prefix to be reused.
+# OpenAI only caches prompts of 1024+ tokens, which ours are not yet, so this is
+# groundwork rather than a speedup today. Sent via extra_body because the typed
+# kwarg only exists in openai>=1.99.
+PROMPT_CACHE_KEY = "admin_rewrite.v1"
+
+# Bullet / numbering characters trimmed from each line ("- ", "• ", "1. ", "2) ").
+_BULLET_SET = frozenset(" -•\t")
+_NUMBER_SET = frozenset("0123456789. )(")
+
 def clean_lines(text: str, n: int) -> list[str]:
+    # Two-pointer trim per line; no intermediate strings until the final slice.
     lines = []
+    if n <= 0:
+        return lines
     for raw in text.split("\n"):
-        s = raw.strip()
-        if not s:
-            continue
-        s = s.strip(" -•\t")
-        s = s.lstrip("0123456789. )(").strip()
-        if s:
-            lines.append(s)
-        if len(lines) >= n:
-            break
-    return lines[:n]
+        i, j = 0, len(raw)
+        while i < j and raw[i].isspace():
+            i += 1
+        while j > i and raw[j - 1].isspace():
+            j -= 1
+        while i < j and raw[i] in _BULLET_SET:
+            i += 1
+        while j > i and raw[j - 1] in _BULLET_SET:
+            j -= 1
+        while i < j and raw[i] in _NUMBER_SET:
+            i += 1
+        while i < j and raw[i].isspace():
+            i += 1
+        while j > i and raw[j - 1].isspace():
+            j -= 1
+        if i < j:
+            lines.append(raw[i:j])
+            if len(lines) >= n:
+                break
+    return lines
 
-def ai_paraphrase_variants(client, base_text: str, n: int, max_chars: int, kind: str) -> list[str]:
+def _constraints(kind: str, max_chars: int) -> str:
+    """Content rules for one message group; shared by the batched and per-group prompts."""
     if kind == "x":
-        user_prompt = f"""
-Create {n} paraphrases of the message in English.
-
-Constraints:
+        return f"""
 - One sentence.
 - Neutral, factual tone.
 - Max {max_chars} characters.
 - No hashtags.
 - No emojis.
-
-Message:
-{base_text}
 """.strip()
-    else:
-        user_prompt = f"""
-Create {n} paraphrases of the message in English.
-
-Constraints:
+    return """
 - Keep meaning.
 - Neutral, factual tone.
 - No emojis.
 - Keep it concise.
+""".strip()
+
+def ai_paraphrase_variants(client, base_text: str, n: int, max_chars: int, kind: str) -> list[str]:
+    user_prompt = f"""
+Create {n} paraphrases of the message in English.
+
+Constraints:
+{_constraints(kind, max_chars)}
 Return each variant on a new line.
 
 Message:
 {base_text}
 """.strip()
 
-    resp = client.responses.create(
+    stream = client.responses.create(
         model="gpt-4.1-mini",
         input=[
             {"role": "system", "content": SYSTEM_PROMPT},
             {"role": "user", "content": user_prompt},
         ],
+        extra_body={"prompt_cache_key": PROMPT_CACHE_KEY},
+        stream=True,
     )
 
-    out = clean_lines(resp.output_text, n)
+    # Clean lines as they arrive; stop the generation once n are collected.
+    out = []
+    buf = ""
+    try:
+        for event in stream:
+            if event.type != "response.output_text.delta":
+                continue
+            buf += event.delta
+            if "\n" not in buf:
+                continue
+            complete, _, buf = buf.rpartition("\n")
+            out += clean_lines(complete, n - len(out))
+            if len(out) >= n:
+                break
+        else:
+            out += clean_lines(buf, n - len(out))
+    finally:
+        stream.close()
+
     if kind == "x":
         out = [clamp_x(x, max_chars) for x in out]
     return out
 
+async def ai_paraphrase_variants_async(client, base_text: str, n: int, max_chars: int, kind: str) -> list[str]:
+    # The sync client is thread-safe; run the blocking call off the event loop.
+    return await asyncio.to_thread(ai_paraphrase_variants, client, base_text, n, max_chars, kind)
+
+async def _gather_variants(client, jobs: dict[str, tuple[str, int, int, str]]) -> dict[str, list[str]]:
+    results = await asyncio.gather(*[ai_paraphrase_variants_async(client, *job) for job in jobs.values()])
+    return dict(zip(jobs, results))
+
+def ai_paraphrase_all(client, groups: dict[str, tuple[str, int, int, str]]) -> dict[str, list[str]]:
+    """
+    Paraphrases every group in a single request.
+    groups maps a key (e.g. "x_short") to (base_text, n, max_chars, kind).
+    Groups missing from the response, or with fewer than n usable variants,
+    fall back to ai_paraphrase_variants, issued concurrently.
+    """
+    if not groups:
+        return {}
+
+    sections = []
+    for key, (base_text, n, max_chars, kind) in groups.items():
+        sections.append(f"""
+Key: {key}
+Create {n} paraphrases of the message in English.
+
+Constraints:
+{_constraints(kind, max_chars)}
+
+Message:
+{base_text}
+""".strip())
+
+    user_prompt = (
+        "Return a JSON object with one key per group below; "
+        "each value is an array of paraphrases.\n\n" + "\n\n---\n\n".join(sections)
+    )
+
+    schema = {
+        "type": "object",
+        "properties": {key: {"type": "array", "items": {"type": "string"}} for key in groups},
+        "required": list(groups),
+        "additionalProperties": False,
+    }
+
+    resp = client.responses.create(
+        model="gpt-4.1-mini",
+        input=[
+            {"role": "system", "content": SYSTEM_PROMPT},
+            {"role": "user", "content": user_prompt},
+        ],
+        extra_body={"prompt_cache_key": PROMPT_CACHE_KEY},
+        text={"format": {"type": "json_schema", "name": "paraphrases", "schema": schema, "strict": True}},
+    )
+
+    try:
+        parsed = json.loads(resp.output_text)
+    except ValueError:
+        parsed = {}
+    if not isinstance(parsed, dict):
+        parsed = {}
+
+    results = {}
+    missing = {}
+    for key, (base_text, n, max_chars, kind) in groups.items():
+        items = parsed.get(key)
+        out = []
+        if isinstance(items, list):
+            out = [s.strip() for s in items if isinstance(s, str) and s.strip()][:n]
+        if len(out) < n:
+            missing[key] = groups[key]
+            continue
+        if kind == "x":
+            out = [clamp_x(x, max_chars) for x in out]
+        results[key] = out
+
+    if missing:
+        results.update(asyncio.run(_gather_variants(client, missing)))
+    return {key: results[key] for key in groups}
+
+_COMMIT_HOOKS = ("pre-commit", "prepare-commit-msg", "commit-msg", "post-commit")
+
+def _needs_git_cli(repo) -> bool:
+    """libgit2 commits skip hooks and signing; leave those repos to the git CLI."""
+    config = repo.config
+    if "commit.gpgsign" in config and config.get_bool("commit.gpgsign"):
+        return True
+    if "core.hooksPath" in config:
+        hooks = Path(repo.workdir) / Path(config["core.hooksPath"]).expanduser()
+    else:
+        # Linked worktrees keep their own git dir but share hooks with the
+        # main repository; `commondir` points back at it.
+        git_dir = Path(repo.path)
+        commondir = git_dir / "commondir"
+        if commondir.is_file():
+            git_dir = git_dir / commondir.read_text(encoding="utf-8").strip()
+        hooks = git_dir / "hooks"
+    return any(os.access(hooks / name, os.X_OK) and (hooks / name).is_file() for name in _COMMIT_HOOKS)
+
+def _git_commit_pygit2(files: list[str], message: str) -> bool:
+    """
+    Stages and commits in-process via libgit2 (no git child processes).
+    libgit2 runs no commit hooks and does not sign, so repos with commit hooks
+    or commit.gpgsign set are committed through the git CLI instead.
+    """
+    try:
+        repo_path = pygit2.discover_repository(os.getcwd())
+        if repo_path is None:
+            print("✗ Git operation failed: not a git repository")
+            return False
+        repo = pygit2.Repository(repo_path)
+        if _needs_git_cli(repo):
+            return _git_commit_cli(files, message)
+        workdir = Path(repo.workdir).resolve()
+        paths = [Path(f).resolve().relative_to(workdir).as_posix() for f in files]
+        parents = [] if repo.head_is_unborn else [repo.head.target]
+
+        # Commit HEAD's tree plus just these paths (like `git commit -- <files>`),
+        # so unrelated staged changes stay staged instead of riding along.
+        staged = pygit2.Index()
+        if parents:
+            staged.read_tree(repo[parents[0]].tree)
+        for path in paths:
+            repo.index.add(path)
+            staged.add(repo.index[path])
+        repo.index.write()
+        tree = staged.write_tree(repo)
+
+        if parents and repo[parents[0]].tree_id == tree:
+            print("i Git: nothing to commit.")
+            return True
+
+        sig = repo.default_signature
+        repo.create_commit("HEAD", sig, sig, message, tree, parents)
+        return True
+    except (pygit2.GitError, KeyError, ValueError) as e:
+        print("✗ Git operation failed:", e)
+        return False
+
+def _git_commit_cli(files: list[str], message: str) -> bool:
+    # Commit the paths directly; only fall back to an explicit `git add` when a
+    # file is not tracked yet. Common case is a single git process.
+    # Output is matched below, so force git's untranslated messages.
+    env = {**os.environ, "LC_ALL": "C"}
+    cmd = ["git", "commit", "-m", message, "--", *files]
+    commit = subprocess.run(cmd, capture_output=True, text=True, env=env)
+    if commit.returncode != 0 and "did not match any file(s) known to git" in commit.stderr:
+        subprocess.run(["git", "add", *files], check=True, env=env)
+        commit = subprocess.run(cmd, capture_output=True, text=True, env=env)
+
+    if commit.returncode != 0:
+        combined = (commit.stdout + "\n" + commit.stderr).lower()
+        if "nothing to commit" in combined or "nothing added to commit" in combined:
+            print("i Git: nothing to commit.")
+        else:
+            print(commit.stdout)
+            print(commit.stderr)
+            return False
+    return True
+
 def git_commit_and_push(files: list[str], message: str) -> bool:
     """
     Adds files, commits (if changes exist), then pushes.
+    Uses pygit2 for add/commit when available, the git CLI otherwise.
+    Push always goes through the git CLI so credential helpers and SSH config apply.
     If push is rejected, user must pull/rebase manually (by design).
     """
     try:
-        subprocess.run(["git", "add", *files], check=True)
-
-        commit = subprocess.run(["git", "commit", "-m", message], capture_output=True, text=True)
-        if commit.returncode != 0:
-            combined = (commit.stdout + "\n" + commit.stderr).lower()
-            if "nothing to commit" in combined:
-                print("i Git: nothing to commit.")
-            else:
-                print(commit.stdout)
-                print(commit.stderr)
-                return False
+        commit = _git_commit_pygit2 if pygit2 else _git_commit_cli
+        if not commit(files, message):
+            return False
 
-        push = subprocess.run(["git", "push"], capture_output=True, text=True)
+        # Push progress goes to stderr; only keep it around to report failures.
+        push = subprocess.run(["git", "push"], stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
         if push.returncode != 0:
-            print(push.stdout)
             print(push.stderr)
             return False
 
@@ -204,6 +435,51 @@ BIO_TEMPLATES = [
     "Blackouts conceal abuses. Speak up for {country}."
 ]
 
+def _build_renderer(groups: dict[str, list[str]]):
+    """
+    Generates straight-line Python for every template group at import time:
+    def _render_all(v, hashtags) -> {group: [f"...", ...]}
+    Fields are bound to locals once; each template becomes a single f-string.
+    """
+    fields = set()
+    rendered = {}
+    for group, templates in groups.items():
+        exprs = []
+        for t in templates:
+            body = []
+            for literal, field, spec, conversion in string.Formatter().parse(t):
+                body.append(literal.replace("{", "{{").replace("}", "}}"))
+                if field is None:
+                    continue
+                if not field.isidentifier() or keyword.iskeyword(field) or "{" in (spec or ""):
+                    raise ValueError(f"Unsupported template field {field!r} in {group}")
+                fields.add(field)
+                body.append("{" + field + (f"!{conversion}" if conversion else "") + (f":{spec}" if spec else "") + "}")
+            exprs.append("f" + repr("".join(body)))
+        rendered[group] = exprs
+
+    lines = ["def _render_all(v, hashtags):"]
+    lines += [f"    {f} = v[{f!r}]" for f in sorted(fields - {"hashtags"})]
+    lines.append("    return {")
+    for group, exprs in rendered.items():
+        lines.append(f"        {group!r}: [")
+        lines += [f"            {e}," for e in exprs]
+        lines.append("        ],")
+    lines.append("    }")
+
+    ns = {}
+    exec(compile("\n".join(lines) + "\n", "<templates>", "exec"), ns)
+    return ns["_render_all"]
+
+render_all = _build_renderer({
+    "x_short": X_SHORT_TEMPLATES,
+    "x_factual": X_FACTUAL_TEMPLATES,
+    "x_cta": X_CTA_TEMPLATES,
+    "ig_caption": IG_CAPTION_TEMPLATES,
+    "ig_story": IG_STORY_TEMPLATES,
+    "bio": BIO_TEMPLATES,
+})
+
 def build_output(cfg: dict, vars_: dict, use_ai: bool, n_x: int, n_ig: int) -> dict:
     max_x = int(cfg.get("limits", {}).get("x_max_chars", 190))
     hashtags_x = cfg.get("hashtags", {}).get("x", "")
@@ -211,42 +487,48 @@ def build_output(cfg: dict, vars_: dict, use_ai: bool, n_x: int, n_ig: int) -> d
 
     client = get_client() if use_ai else None
 
-    def gen_from_templates(templates: list[str], count: int) -> list[str]:
-        out = []
-        for t in templates:
-            out.append(fill(t, vars_))
-            if len(out) >= count:
-                break
-        return out[:count]
+    rendered = render_all(vars_, hashtags_ig)
 
     # ---- X ----
-    x_short = [clamp_x(m, max_x) for m in gen_from_templates(X_SHORT_TEMPLATES, n_x)]
-    x_factual = [clamp_x(m, max_x) for m in gen_from_templates(X_FACTUAL_TEMPLATES, n_x)]
-    x_cta = [clamp_x(m, max_x) for m in gen_from_templates(X_CTA_TEMPLATES, n_x)]
-
-    # Optional AI paraphrase (generates n variants from first template)
-    if client:
-        if x_short:
-            x_short = ai_paraphrase_variants(client, x_short[0], n_x, max_x, "x")
-        if x_factual:
-            x_factual = ai_paraphrase_variants(client, x_factual[0], n_x, max_x, "x")
-        if x_cta:
-            x_cta = ai_paraphrase_variants(client, x_cta[0], n_x, max_x, "x")
+    x_short_raw = rendered["x_short"][:n_x]
+    x_factual_raw = rendered["x_factual"][:n_x]
+    x_cta_raw = rendered["x_cta"][:n_x]
 
     # ---- Instagram ----
-    ig_caption = [fill(t, {**vars_, "hashtags": hashtags_ig}) for t in IG_CAPTION_TEMPLATES][:n_ig]
-    ig_story = [fill(t, vars_) for t in IG_STORY_TEMPLATES][:n_ig]
+    ig_caption_raw = rendered["ig_caption"][:n_ig]
+    ig_story_raw = rendered["ig_story"][:n_ig]
 
-    # Optional AI paraphrase for IG (keeps multi-line allowed)
+    # Optional AI paraphrase (generates n variants from first template of each group, in one request).
+    # Template output is only clamped when it is what we actually return.
     if client:
-        if ig_caption:
-            ig_caption = ai_paraphrase_variants(client, ig_caption[0], n_ig, max_x, "instagram_caption")
-            ig_caption = [c if hashtags_ig in c else (c.rstrip() + "\n\n" + hashtags_ig) for c in ig_caption]
-        if ig_story:
-            ig_story = ai_paraphrase_variants(client, ig_story[0], n_ig, max_x, "instagram_story")
+        groups = {}
+        if x_short_raw:
+            groups["x_short"] = (x_short_raw[0], n_x, max_x, "x")
+        if x_factual_raw:
+            groups["x_factual"] = (x_factual_raw[0], n_x, max_x, "x")
+        if x_cta_raw:
+            groups["x_cta"] = (x_cta_raw[0], n_x, max_x, "x")
+        if ig_caption_raw:
+            groups["ig_caption"] = (ig_caption_raw[0], n_ig, max_x, "instagram_caption")
+        if ig_story_raw:
+            groups["ig_story"] = (ig_story_raw[0], n_ig, max_x, "instagram_story")
+
+        paraphrased = ai_paraphrase_all(client, groups)
+        x_short = paraphrased.get("x_short", [])
+        x_factual = paraphrased.get("x_factual", [])
+        x_cta = paraphrased.get("x_cta", [])
+        ig_story = paraphrased.get("ig_story", [])
+        # IG keeps multi-line allowed; make sure hashtags survive the rewrite
+        ig_caption = [c if hashtags_ig in c else (c.rstrip() + "\n\n" + hashtags_ig) for c in paraphrased.get("ig_caption", [])]
+    else:
+        x_short = [clamp_x(m, max_x) for m in x_short_raw]
+        x_factual = [clamp_x(m, max_x) for m in x_factual_raw]
+        x_cta = [clamp_x(m, max_x) for m in x_cta_raw]
+        ig_caption = ig_caption_raw
+        ig_story = ig_story_raw
 
     # ---- Bio ----
-    bio = [fill(t, vars_) for t in BIO_TEMPLATES][:max(3, min(6, n_ig))]
+    bio = rendered["bio"][:max(3, min(6, n_ig))]
 
     return {
         "generated": {
@@ -290,12 +572,25 @@ def main():
     vars_ = compute_vars(cfg)
     out = build_output(cfg, vars_, use_ai=args.ai, n_x=args.x_n, n_ig=args.ig_n)
 
+    payload = dump_json(out) + b"\n"
+
     print("\n=== GENERATED JSON (preview) ===\n")
-    print(json.dumps(out, ensure_ascii=False, indent=2))
+    sys.stdout.flush()
+    sys.stdout.buffer.write(payload)
+    sys.stdout.flush()
 
     if args.write:
         target = Path(args.file)
-        target.write_text(json.dumps(out, ensure_ascii=False, indent=2) + "\n", encoding="utf-8")
+        # Write next to the target and rename over it so readers never see a partial file.
+        tmp = target.with_suffix(target.suffix + ".tmp")
+        try:
+            tmp.write_bytes(payload)
+            if target.exists():
+                shutil.copymode(target, tmp)
+            os.replace(tmp, target)
+        except BaseException:
+            tmp.unlink(missing_ok=True)
+            raise
         print("\n=== WROTE FILE ===")
         print(f"Updated: {target.resolve()}")
 